@@ -1,24 +1,71 @@
 import os
-import json
-import base64
-import requests
+import hashlib
+import orjson
+import asyncio
+import httpx
+import ijson
 from datetime import datetime
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, AsyncIterator, NamedTuple
 import openai
+import numpy as np
+from cachetools import TTLCache
+from api.discourse_http import ResponseReader, TokenBucket
 import sqlite3
 import logging
 import re
-import time
+import threading
+import tempfile
+import fcntl
+from itertools import islice
+
+# Optional: semantic retrieval over Discourse posts
+try:
+    import sqlite_vec
+except ImportError:
+    sqlite_vec = None
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+except ImportError:
+    onnxruntime = None
+try:
+    import faiss
+except ImportError:
+    faiss = None
+# Optional: answer cache shared across workers
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # FastAPI setup
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global virtual_ta
+    # Built here rather than at import: with workers > 1 uvicorn's supervisor imports this
+    # module too, and must not load the model, open the DB and start clients it never uses
+    virtual_ta = VirtualTA()
+    # Pay the cold-cache cost once per worker, not on the first question
+    await run_in_threadpool(virtual_ta.knowledge_base.warm_up)
+    yield
+    await virtual_ta.scraper.aclose()
+    await virtual_ta.answers.aclose()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -29,88 +76,403 @@ app.add_middleware(
 
 # OpenAI config
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
+openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
 DATABASE_PATH = 'tds_knowledge.db'
+SQLITE_MMAP_SIZE = 268435456  # 256 MiB; reads come straight from the page cache
+SQLITE_CACHE_SIZE = -64000  # negative means KiB, so ~64 MB per connection
+
+# Discourse scraping
+DISCOURSE_RATE_LIMIT = 5  # requests per second
+DISCOURSE_WORKERS = 8  # concurrent topic fetchers
+DISCOURSE_MAX_IN_FLIGHT = 10  # open requests across searches and topic fetches
+
+# Shape check for base64 images; avoids decoding multi-MB payloads just to validate
+_B64_RE = re.compile(r'[A-Za-z0-9+/]*={0,2}')
+
+# Keyword extraction
+_WORD_RE = re.compile(r'\b\w+\b')
+_STOP_WORDS = frozenset({'the', 'is', 'at', 'which', 'on', 'a', 'an', 'and', 'or', 'but', 'in', 'with', 'to', 'for', 'of', 'as', 'by'})
+
+# Kept byte-identical across requests so the provider can cache the prompt prefix
+SYSTEM_PROMPT = """You are a helpful Teaching Assistant for the TDS course at IIT Madras. Be concise and helpful."""
+
+# Semantic answer cache
+EMBEDDING_MODEL = 'text-embedding-3-small'
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_SIZE = 1024  # most recent questions kept for matching
+
+# Exact-match answer cache: per-process L1 in front of an optional Redis L2
+REDIS_URL = os.getenv('REDIS_URL')
+ANSWER_CACHE_SIZE = 2048
+ANSWER_CACHE_TTL = 600  # seconds
+ANSWER_CACHE_PREFIX = 'tds:answer:'
+
+# Local embeddings for semantic retrieval
+LOCAL_EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+LOCAL_EMBEDDING_DIM = 384
+LOCAL_EMBEDDING_BATCH = 64
+LOCAL_EMBEDDING_MAX_SEQ = 256  # tokens; posts are truncated to this anyway
+LOCAL_EMBEDDING_THREADS = 1  # one inference thread per worker for steady latency
+# Directory with an int8-quantized export of the same model (model.int8.onnx + tokenizer.json);
+# used instead of sentence-transformers when set
+LOCAL_EMBEDDING_ONNX_DIR = os.getenv('EMBEDDING_ONNX_DIR')
+
+# Hybrid ranking: candidates per leg and blend weights
+HYBRID_CANDIDATES = 50
+HYBRID_BM25_WEIGHT = 0.4
+HYBRID_VECTOR_WEIGHT = 0.6
+HYBRID_MAX_DISTANCE = 0.65  # cosine distance; the vector leg always returns k rows, however unrelated
+
+# Optional FAISS IVF-PQ index over discourse_vec; SQLite stays the source of truth.
+# It and the files below sit next to the database, named after it
+FAISS_INDEX_SUFFIX = '.faiss'
+FAISS_MIN_VECTORS = 100_000  # below this the exact vec0 scan is fast enough
+FAISS_NLIST = 256
+FAISS_PQ_M = 48
+FAISS_PQ_BITS = 8
+FAISS_NPROBE = 16
+FAISS_OVERFETCH = 4  # ANN candidates per result, re-ranked exactly by vec0
+
+# Below the FAISS threshold: all post vectors as one contiguous float32 matrix (one BLAS
+# matrix-vector product per query), memory-mapped so workers share the page cache
+VECTORS_SUFFIX = '.vecs.f32'
+VECTOR_IDS_SUFFIX = '.ids.i64'
+VECTOR_LOCK_SUFFIX = '.vec.lock'  # serializes FAISS training and vector exports across workers
+
+class FtsIndex(NamedTuple):
+    table: str
+    columns: Tuple[str, ...]
+    weights: Tuple[float, ...]  # bm25 column weights
+    result_columns: str  # SELECT list in the row layout _row_to_result expects
+
+FTS_TABLES = {
+    'discourse_posts_fts': FtsIndex(
+        'discourse_posts', ('title', 'content', 'excerpt'), (3.0, 1.0, 2.0),
+        "'discourse', t.title, t.url, substr(t.content, 1, 500), t.excerpt, NULL"
+    ),
+    'course_content_fts': FtsIndex(
+        'course_content', ('title', 'content'), (3.0, 1.0),
+        "'course', t.title, NULL, substr(t.content, 1, 500), NULL, t.source"
+    ),
+}
+FTS_OVERFETCH = 10
 
 # ----- Models -----
 class QuestionRequest(BaseModel):
     question: str
     image: Optional[str] = None
 
+# Declared return types let FastAPI serialize responses straight to JSON bytes via Pydantic
+class Link(BaseModel):
+    url: str
+    text: Optional[str] = None
+
+class AnswerResponse(BaseModel):
+    answer: str
+    links: List[Link]
+
+class MessageResponse(BaseModel):
+    message: str
+
+class HealthResponse(BaseModel):
+    status: str
+
 # ----- Classes -----
 
+class TopicContent(NamedTuple):
+    content: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
 class DiscourseScraperTDS:
-    def __init__(self, base_url="https://discourse.onlinedegree.iitm.ac.in"):
+    def __init__(self, base_url="https://discourse.onlinedegree.iitm.ac.in",
+                 rate_limit: float = DISCOURSE_RATE_LIMIT, workers: int = DISCOURSE_WORKERS):
         self.base_url = base_url
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0'
-        })
+        self.client = httpx.AsyncClient(
+            headers={'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': 'gzip, br'},
+            limits=httpx.Limits(max_keepalive_connections=32),
+            http2=True,
+            timeout=30
+        )
+        self.limiter = TokenBucket(rate_limit)
+        self.workers = workers
+        self._in_flight = asyncio.Semaphore(DISCOURSE_MAX_IN_FLIGHT)
+        # topic_id -> content, reset per scrape; the same topic matches several terms
+        self._topic_cache: Dict[int, TopicContent] = {}
+        # url -> what we stored last time, for conditional GETs
+        self._known: Dict[str, TopicContent] = {}
+
+    async def aclose(self):
+        await self.client.aclose()
 
-    def scrape_posts_by_date_range(self, start_date: str, end_date: str) -> List[Dict]:
+    async def scrape_posts_by_date_range(self, start_date: str, end_date: str,
+                                         known: Optional[Dict[str, TopicContent]] = None) -> List[Dict]:
         posts = []
+        self._topic_cache.clear()
+        self._known = known or {}
         try:
             start_dt = datetime.strptime(start_date, '%Y-%m-%d')
             end_dt = datetime.strptime(end_date, '%Y-%m-%d')
             search_terms = ['TDS', 'Tools in Data Science', 'assignment', 'project']
-            for term in search_terms:
-                posts.extend(self._search_posts(term, start_dt, end_dt))
-                time.sleep(1)
+            # Searches produce topics, workers fetch their content as they arrive;
+            # the shared token bucket paces both sides
+            queue: asyncio.Queue = asyncio.Queue()
+            seen = set()
+            consumers = [asyncio.create_task(self._consume_topics(queue, posts)) for _ in range(self.workers)]
+            try:
+                await asyncio.gather(*[
+                    self._search_posts(term, start_dt, end_dt, queue, seen) for term in search_terms
+                ])
+                await queue.join()
+            finally:
+                for consumer in consumers:
+                    consumer.cancel()
+                await asyncio.gather(*consumers, return_exceptions=True)
             unique_posts = {post['url']: post for post in posts}
             return list(unique_posts.values())
         except Exception as e:
             logger.error(f"Error scraping posts: {e}")
             return []
 
-    def _search_posts(self, search_term: str, start_date: datetime, end_date: datetime) -> List[Dict]:
-        posts = []
+    async def _search_posts(self, search_term: str, start_date: datetime, end_date: datetime,
+                            queue: asyncio.Queue, seen: set):
         try:
             search_url = f"{self.base_url}/search.json"
             params = {
                 'q': f"{search_term} after:{start_date.strftime('%Y-%m-%d')} before:{end_date.strftime('%Y-%m-%d')}",
                 'page': 1
             }
-            response = self.session.get(search_url, params=params)
+            async with self._in_flight:
+                response = await self._send(search_url, params=params)
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 for topic in data.get('topics', []):
-                    post_data = {
-                        'title': topic.get('title', ''),
-                        'url': f"{self.base_url}/t/{topic.get('slug', '')}/{topic.get('id', '')}",
-                        'created_at': topic.get('created_at', ''),
-                        'excerpt': topic.get('excerpt', ''),
-                        'category_name': topic.get('category_name', ''),
-                        'posts_count': topic.get('posts_count', 0),
-                        'content': self._fetch_topic_content(topic.get('id'))
-                    }
-                    posts.append(post_data)
+                    if topic.get('id') not in seen:
+                        seen.add(topic.get('id'))
+                        queue.put_nowait(topic)
         except Exception as e:
             logger.error(f"Error searching posts: {e}")
-        return posts
 
-    def _fetch_topic_content(self, topic_id: int) -> str:
+    async def _consume_topics(self, queue: asyncio.Queue, posts: List[Dict]):
+        while True:
+            topic = await queue.get()
+            try:
+                url = f"{self.base_url}/t/{topic.get('slug', '')}/{topic.get('id', '')}"
+                fetched = await self._fetch_topic_content(topic.get('id'), self._known.get(url))
+                posts.append({
+                    'title': topic.get('title', ''),
+                    'url': url,
+                    'created_at': topic.get('created_at', ''),
+                    'excerpt': topic.get('excerpt', ''),
+                    'category_name': topic.get('category_name', ''),
+                    'posts_count': topic.get('posts_count', 0),
+                    'content': fetched.content,
+                    'etag': fetched.etag,
+                    'last_modified': fetched.last_modified
+                })
+            finally:
+                queue.task_done()
+
+    async def _send(self, url: str, params: Optional[Dict] = None, stream: bool = False,
+                    headers: Optional[Dict] = None) -> httpx.Response:
+        """Rate-limited GET that honours Retry-After on 429; streamed responses must be closed by the caller"""
+        for attempt in range(3):
+            await self.limiter.acquire()
+            request = self.client.build_request('GET', url, params=params, headers=headers)
+            response = await self.client.send(request, stream=stream)
+            if response.status_code != 429 or attempt == 2:
+                return response
+            await response.aclose()
+            retry_after = response.headers.get('Retry-After', '')
+            delay = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+            logger.warning(f"Rate limited by Discourse, retrying {url} in {delay}s")
+            await asyncio.sleep(delay)
+
+    async def _fetch_topic_content(self, topic_id: int, known: Optional[TopicContent] = None) -> TopicContent:
+        if topic_id in self._topic_cache:
+            return self._topic_cache[topic_id]
         try:
             topic_url = f"{self.base_url}/t/{topic_id}.json"
-            response = self.session.get(topic_url)
-            if response.status_code == 200:
-                data = response.json()
-                posts = data.get('post_stream', {}).get('posts', [])
-                content_parts = [post.get('raw', '') for post in posts[:5]]
-                return '\n\n'.join(content_parts)
+            headers = {}
+            if known and known.etag:
+                headers['If-None-Match'] = known.etag
+            if known and known.last_modified:
+                headers['If-Modified-Since'] = known.last_modified
+            # Hold the slot until the streamed body has been read
+            async with self._in_flight:
+                response = await self._send(topic_url, stream=True, headers=headers)
+                try:
+                    if response.status_code == 304:
+                        # Unchanged since the last scrape; nothing to download or parse
+                        self._topic_cache[topic_id] = known
+                        return known
+                    if response.status_code == 200:
+                        # Only the first 5 posts are used; stop parsing once we have them
+                        content_parts = []
+                        posts = ijson.items(ResponseReader(response), 'post_stream.posts.item', use_float=True)
+                        async for post in posts:
+                            content_parts.append(post.get('raw', ''))
+                            if len(content_parts) == 5:
+                                break
+                        fetched = TopicContent(
+                            '\n\n'.join(content_parts),
+                            response.headers.get('ETag'),
+                            response.headers.get('Last-Modified')
+                        )
+                        self._topic_cache[topic_id] = fetched
+                        return fetched
+                    logger.warning(f"Fetching topic {topic_id} failed with status {response.status_code}")
+                finally:
+                    await response.aclose()
         except Exception as e:
             logger.error(f"Error fetching topic {topic_id}: {e}")
-        return ""
+        # A failed fetch says nothing about the topic; keep what we already have rather than blank it
+        return known or TopicContent("")
 
 
-class KnowledgeBase:
-    def __init__(self, db_path: str = DATABASE_PATH):
+class SQLiteStore:
+    """Holds one long-lived, pragma-tuned connection per thread"""
+
+    def __init__(self, db_path: str = DATABASE_PATH, load_vec: bool = False):
         self.db_path = db_path
+        self._local = threading.local()
+        self.load_vec = load_vec
+        self.vec_loaded = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA temp_store = MEMORY')
+            conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+            conn.execute(f'PRAGMA cache_size = {SQLITE_CACHE_SIZE}')
+            if self.load_vec:
+                self._load_vec(conn)
+            self._local.conn = conn
+        return conn
+
+    def _load_vec(self, conn: sqlite3.Connection):
+        try:
+            if sqlite_vec is None:
+                raise ImportError("sqlite-vec is not installed")
+            conn.enable_load_extension(True)
+            sqlite_vec.load(conn)
+            conn.enable_load_extension(False)
+            self.vec_loaded = True
+        except (ImportError, AttributeError, sqlite3.OperationalError) as e:
+            # Some Python builds ship sqlite3 without extension loading; don't retry per thread
+            logger.warning(f"sqlite-vec unavailable, using keyword search only: {e}")
+            self.load_vec = False
+
+
+class OnnxEmbedder:
+    """int8 ONNX Runtime encoder with the SentenceTransformer.encode interface the store uses"""
+
+    def __init__(self, model_dir: str):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = LOCAL_EMBEDDING_THREADS
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, 'model.int8.onnx'), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(LOCAL_EMBEDDING_MAX_SEQ)
+        self.tokenizer.enable_padding()
+
+    def encode(self, texts: List[str], batch_size: int = LOCAL_EMBEDDING_BATCH,
+               normalize_embeddings: bool = True) -> np.ndarray:
+        batches = [self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        embeddings = np.vstack(batches) if batches else np.empty((0, LOCAL_EMBEDDING_DIM), dtype=np.float32)
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer.encode_batch(texts)
+        inputs = {
+            'input_ids': np.array([e.ids for e in encoded], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encoded], dtype=np.int64),
+            'token_type_ids': np.array([e.type_ids for e in encoded], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+        # Mean-pool over real tokens, as sentence-transformers does for MiniLM
+        mask = inputs['attention_mask'][:, :, np.newaxis].astype(np.float32)
+        return ((hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)).astype(np.float32)
+
+
+_MODEL = None
+_MODEL_LOADED = False
+
+
+def get_model():
+    """Process-wide embedding model, loaded on first use; None when unavailable"""
+    global _MODEL, _MODEL_LOADED
+    if _MODEL_LOADED:
+        return _MODEL
+    _MODEL_LOADED = True
+    if LOCAL_EMBEDDING_ONNX_DIR and onnxruntime is not None:
+        try:
+            _MODEL = OnnxEmbedder(LOCAL_EMBEDDING_ONNX_DIR)
+            return _MODEL
+        except Exception as e:
+            logger.warning(f"ONNX embedder unavailable, trying sentence-transformers: {e}")
+    if SentenceTransformer is None:
+        return None
+    try:
+        import torch
+        torch.set_num_threads(LOCAL_EMBEDDING_THREADS)
+        _MODEL = SentenceTransformer(LOCAL_EMBEDDING_MODEL, device='cpu')
+        _MODEL.max_seq_length = LOCAL_EMBEDDING_MAX_SEQ
+    except Exception as e:
+        logger.warning(f"Embedding model unavailable, using keyword search only: {e}")
+    return _MODEL
+
+
+def _replace_file(path: str, write):
+    """Write through a uniquely named temp file and swap it in, so concurrent writers
+    don't clobber each other's temp file and readers never see a half-written one"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class KnowledgeBase(SQLiteStore):
+    def __init__(self, db_path: str = DATABASE_PATH, index_path: Optional[str] = None,
+                 vectors_path: Optional[str] = None, ids_path: Optional[str] = None,
+                 lock_path: Optional[str] = None):
+        self.embedder = get_model()
+        super().__init__(db_path, load_vec=self.embedder is not None)
+        self._conn()  # records whether sqlite-vec loaded
+        self.vector_search = self.vec_loaded
+        # Derived files default to siblings of the database, not the working directory
+        stem = os.path.splitext(db_path)[0]
+        self.index_path = index_path or stem + FAISS_INDEX_SUFFIX
+        self.vectors_path = vectors_path or stem + VECTORS_SUFFIX
+        self.ids_path = ids_path or stem + VECTOR_IDS_SUFFIX
+        self.lock_path = lock_path or stem + VECTOR_LOCK_SUFFIX
+        self._ann_lock = threading.Lock()
+        self._mapped: Optional[Tuple[int, np.ndarray, np.ndarray]] = None  # (mtime_ns, ids, vectors)
+        self._ann: Optional[Tuple[int, object]] = None  # (mtime_ns, faiss index)
         self.init_database()
+        if self.vector_search:
+            # Every worker runs this at startup; the first one in builds, the rest find the files
+            with self._file_lock():
+                if faiss is not None and not os.path.exists(self.index_path):
+                    self._build_ann()
+                if self._ann_index() is None and not os.path.exists(self.ids_path):
+                    self._export_vectors()
 
     def init_database(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS discourse_posts (
@@ -121,9 +483,16 @@ class KnowledgeBase:
                     created_at TEXT,
                     category_name TEXT,
                     excerpt TEXT,
-                    posts_count INTEGER
+                    posts_count INTEGER,
+                    etag TEXT,
+                    last_modified TEXT
                 )
             ''')
+            # Databases created before the scraper sent conditional GETs
+            columns = {r[1] for r in cursor.execute('PRAGMA table_info(discourse_posts)')}
+            for column in ('etag', 'last_modified'):
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE discourse_posts ADD COLUMN {column} TEXT')
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS course_content (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -133,83 +502,551 @@ class KnowledgeBase:
                     created_at TEXT DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_discourse_created ON discourse_posts(created_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_course_source ON course_content(source)')
+            for fts_table, index in FTS_TABLES.items():
+                self._create_fts_table(cursor, fts_table, index.table, index.columns)
+            if self.vector_search:
+                self._create_vec_table(cursor)
             conn.commit()
 
+    def _create_vec_table(self, cursor):
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'discourse_vec'"
+        ).fetchone()
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS discourse_vec USING vec0(
+                embedding float[{LOCAL_EMBEDDING_DIM}] distance_metric=cosine
+            )
+        ''')
+        if not exists:
+            # Embed posts that were stored before vector search was enabled
+            rows = cursor.execute('SELECT id, title, content FROM discourse_posts').fetchall()
+            if rows:
+                embeddings = self._embed([f"{r[1]}\n{r[2]}" for r in rows])
+                self._store_vectors(cursor, [r[0] for r in rows], embeddings)
+
+    def _create_fts_table(self, cursor, fts_table: str, table: str, columns: tuple):
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+        ).fetchone()
+        cols = ', '.join(columns)
+        new_cols = ', '.join(f'new.{c}' for c in columns)
+        old_cols = ', '.join(f'old.{c}' for c in columns)
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                {cols}, content='{table}', content_rowid='id', tokenize='porter unicode61'
+            )
+        ''')
+        # Keep the external-content index in sync with its table
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new_cols});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+                INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new_cols});
+            END
+        ''')
+        if not exists:
+            # Index rows that were stored before the FTS table existed
+            cursor.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+
     def add_discourse_posts(self, posts: List[Dict]):
-        with sqlite3.connect(self.db_path) as conn:
+        rows = [(
+            post.get('title', ''),
+            post.get('url', ''),
+            post.get('content', ''),
+            post.get('created_at', ''),
+            post.get('category_name', ''),
+            post.get('excerpt', ''),
+            post.get('posts_count', 0),
+            post.get('etag'),
+            post.get('last_modified')
+        ) for post in posts]
+        # Embed before taking the write lock; inference is the slow part
+        texts = {post.get('url', ''): f"{post.get('title', '')}\n{post.get('content', '')}" for post in posts}
+        embeddings = self._embed(list(texts.values())) if self.vector_search and texts else None
+        with self._conn() as conn:
             cursor = conn.cursor()
-            for post in posts:
-                try:
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO discourse_posts 
-                        (title, url, content, created_at, category_name, excerpt, posts_count)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        post.get('title', ''),
-                        post.get('url', ''),
-                        post.get('content', ''),
-                        post.get('created_at', ''),
-                        post.get('category_name', ''),
-                        post.get('excerpt', ''),
-                        post.get('posts_count', 0)
-                    ))
-                except Exception as e:
-                    logger.error(f"DB insert error: {e}")
-            conn.commit()
+            try:
+                # One transaction (and one fsync) for the whole batch
+                cursor.executemany('''
+                    INSERT INTO discourse_posts 
+                    (title, url, content, created_at, category_name, excerpt, posts_count, etag, last_modified)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET
+                        title = excluded.title,
+                        content = excluded.content,
+                        created_at = excluded.created_at,
+                        category_name = excluded.category_name,
+                        excerpt = excluded.excerpt,
+                        posts_count = excluded.posts_count,
+                        etag = excluded.etag,
+                        last_modified = excluded.last_modified
+                ''', rows)
+                if embeddings is not None:
+                    # All ids in one query, in the same order as the embeddings
+                    ids = [r[0] for r in cursor.execute(
+                        'SELECT p.id FROM json_each(?) j JOIN discourse_posts p ON p.url = j.value ORDER BY j.key',
+                        (orjson.dumps(list(texts)),)
+                    )]
+                    self._store_vectors(cursor, ids, embeddings)
+                cursor.execute("INSERT INTO discourse_posts_fts(discourse_posts_fts) VALUES ('optimize')")
+                # Refresh planner statistics after the bulk load
+                cursor.execute('ANALYZE discourse_posts')
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"DB insert error: {e}")
+                return
+        if embeddings is not None:
+            # Refresh the mapped copy first, so workers still reading it see this batch
+            # until the FAISS file (if this batch creates it) switches them over
+            with self._file_lock():
+                if self._ann_index() is None:
+                    self._export_vectors()
+                if faiss is not None:
+                    self._update_ann(ids, embeddings)
+
+    def get_known_topics(self) -> Dict[str, TopicContent]:
+        """Stored content and validators per post url, for the scraper's conditional GETs
+        and as the fallback when a fetch fails"""
+        with self._conn() as conn:
+            rows = conn.execute('SELECT url, content, etag, last_modified FROM discourse_posts').fetchall()
+        return {r[0]: TopicContent(r[1], r[2], r[3]) for r in rows}
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(
+            self.embedder.encode(texts, batch_size=LOCAL_EMBEDDING_BATCH, normalize_embeddings=True),
+            dtype=np.float32
+        )
+
+    def _store_vectors(self, cursor, ids: List[int], embeddings: np.ndarray):
+        # vec0 has no upsert, so replace by delete + insert
+        cursor.executemany('DELETE FROM discourse_vec WHERE rowid = ?', [(i,) for i in ids])
+        cursor.executemany(
+            'INSERT INTO discourse_vec(rowid, embedding) VALUES (?, ?)',
+            [(i, e.tobytes()) for i, e in zip(ids, embeddings)]
+        )
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive across worker processes (and threads, each holding its own descriptor)"""
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _ann_index(self):
+        """Current FAISS index, reloaded when another worker has rewritten the file"""
+        if faiss is None or not self.vector_search:
+            return None
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if self._ann is None or self._ann[0] != mtime:
+            ann = faiss.read_index(self.index_path)
+            ann.nprobe = FAISS_NPROBE
+            self._ann = (mtime, ann)
+        return self._ann[1]
+
+    def _write_ann(self, ann):
+        _replace_file(self.index_path, lambda tmp: faiss.write_index(ann, tmp))
+        self._ann = (os.stat(self.index_path).st_mtime_ns, ann)
+
+    def _read_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self._conn() as conn:
+            rows = conn.execute('SELECT rowid, embedding FROM discourse_vec ORDER BY rowid').fetchall()
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        vectors = np.frombuffer(b''.join(r[1] for r in rows), dtype=np.float32).reshape(len(rows), LOCAL_EMBEDDING_DIM)
+        return ids, vectors
+
+    def _build_ann(self):
+        """Train an IVF-PQ index on every stored vector once the corpus is big enough"""
+        with self._conn() as conn:
+            if conn.execute('SELECT count(*) FROM discourse_vec').fetchone()[0] < FAISS_MIN_VECTORS:
+                return None
+        ids, vectors = self._read_vectors()
+        # L2 on unit vectors ranks the same as cosine
+        ann = faiss.IndexIVFPQ(faiss.IndexFlatL2(LOCAL_EMBEDDING_DIM), LOCAL_EMBEDDING_DIM, FAISS_NLIST, FAISS_PQ_M, FAISS_PQ_BITS)
+        ann.train(vectors)
+        ann.add_with_ids(vectors, ids)
+        ann.nprobe = FAISS_NPROBE
+        self._write_ann(ann)
+        logger.info(f"Built FAISS index over {len(ids)} vectors")
+        return ann
+
+    def _update_ann(self, ids: List[int], embeddings: np.ndarray):
+        # Called under _file_lock; _ann_index() picks up any other worker's last write first
+        ann = self._ann_index()
+        if ann is None:
+            self._build_ann()
+            return
+        ids = np.array(ids, dtype=np.int64)
+        with self._ann_lock:
+            ann.remove_ids(ids)
+            ann.add_with_ids(embeddings, ids)
+            self._write_ann(ann)
+
+    def _export_vectors(self):
+        """Rewrite the memory-mapped copy of discourse_vec; SQLite stays the source of truth"""
+        ids, vectors = self._read_vectors()
+        # ids last since its mtime tells readers to remap
+        for path, array in ((self.vectors_path, vectors), (self.ids_path, ids)):
+            _replace_file(path, array.tofile)
+
+    def _vectors(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Mapped (ids, vectors), remapped when another worker has rewritten the files"""
+        try:
+            mtime = os.stat(self.ids_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if self._mapped is None or self._mapped[0] != mtime:
+            if not os.path.getsize(self.ids_path):
+                return None
+            ids = np.memmap(self.ids_path, dtype=np.int64, mode='r')
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r').reshape(-1, LOCAL_EMBEDDING_DIM)
+            if len(ids) != len(vectors):
+                return None  # caught mid-rewrite; vec0 answers this one
+            self._mapped = (mtime, ids, vectors)
+        return self._mapped[1], self._mapped[2]
+
+    def warm_up(self):
+        """Read through the tables and FTS index pages so they're in the page cache"""
+        with self._conn() as conn:
+            for table in ('discourse_posts', 'course_content', *(f'{fts}_data' for fts in FTS_TABLES)):
+                conn.execute(f'SELECT count(*) FROM {table}').fetchone()
+        if self.vector_search:
+            # The first forward pass pays one-off setup; don't leave it to the first question
+            self._embed(['warm up'])
 
     def search_relevant_content(self, question: str, limit: int = 5) -> List[Dict]:
-        keywords = self._extract_keywords(question)
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            discourse_results, course_results = [], []
-            for keyword in keywords:
-                cursor.execute('''
-                    SELECT title, url, content, excerpt FROM discourse_posts
-                    WHERE title LIKE ? OR content LIKE ? OR excerpt LIKE ?
-                    LIMIT ?
-                ''', (f'%{keyword}%',)*3 + (limit,))
-                discourse_results.extend([
-                    {
-                        'type': 'discourse',
-                        'title': r[0],
-                        'url': r[1],
-                        'content': r[2][:500],
-                        'excerpt': r[3]
-                    } for r in cursor.fetchall()
-                ])
-                cursor.execute('''
-                    SELECT title, content, source FROM course_content
-                    WHERE title LIKE ? OR content LIKE ?
-                    LIMIT ?
-                ''', (f'%{keyword}%', f'%{keyword}%', limit))
-                course_results.extend([
-                    {
-                        'type': 'course',
-                        'title': r[0],
-                        'content': r[1][:500],
-                        'source': r[2]
-                    } for r in cursor.fetchall()
-                ])
-        return (discourse_results + course_results)[:limit]
+        if not self.vector_search:
+            rows = self._search_fts(question, limit)
+        else:
+            vec_rows = [r for r in self._search_vectors(question, HYBRID_CANDIDATES) if r[-1] <= HYBRID_MAX_DISTANCE]
+            rows = self._blend(self._search_fts(question, HYBRID_CANDIDATES), vec_rows)
+        return [self._row_to_result(r) for r in rows[:limit]]
+
+    def _blend(self, fts_rows: List[tuple], vec_rows: List[tuple]) -> List[tuple]:
+        """Rank the union of both legs by weighted, min-max normalized score, best first"""
+        # Each leg is scaled against its no-match bound rather than its own worst row, so
+        # a lone or tied hit isn't inflated to 1.0: bm25 runs from the best hit to 0 (no
+        # match), cosine distance from 0 (identical) to the cutoff
+        lexical = self._normalize_scores(fts_rows, min((r[-1] for r in fts_rows), default=0.0), 0.0)
+        semantic = self._normalize_scores(vec_rows, 0.0, HYBRID_MAX_DISTANCE)
+        # A doc missing from one leg contributes 0 for it
+        blended = {
+            doc: HYBRID_BM25_WEIGHT * lexical.get(doc, 0.0) + HYBRID_VECTOR_WEIGHT * semantic.get(doc, 0.0)
+            for doc in lexical.keys() | semantic.keys()
+        }
+        return sorted(blended, key=blended.get, reverse=True)
+
+    def _normalize_scores(self, rows: List[tuple], best: float, worst: float) -> Dict[tuple, float]:
+        # bm25 and cosine distance are both lower-is-better; map best..worst onto 1..0
+        span = worst - best
+        if span <= 0:
+            return {r[:-1]: 0.0 for r in rows}
+        return {r[:-1]: min(max((worst - r[-1]) / span, 0.0), 1.0) for r in rows}
+
+    def _search_fts(self, question: str, limit: int, indexes: Tuple[str, ...] = tuple(FTS_TABLES)) -> List[tuple]:
+        query = self._build_match_query(question)
+        if not query:
+            return []
+        # Each MATCH sits in its own CTE so the planner resolves it from the FTS index
+        # first; joins and any later filters only see the top hits. Over-fetch there
+        # so post-filters still leave `limit` rows.
+        ctes, arms, params = [], [], []
+        for i, fts_table in enumerate(indexes):
+            index = FTS_TABLES[fts_table]
+            weights = ', '.join(map(str, index.weights))
+            ctes.append(f'''m{i} AS (
+                SELECT rowid, bm25({fts_table}, {weights}) AS score
+                FROM {fts_table}
+                WHERE {fts_table} MATCH ?
+                ORDER BY score
+                LIMIT ?
+            )''')
+            arms.append(f'SELECT {index.result_columns}, m{i}.score AS score FROM m{i} JOIN {index.table} t ON t.id = m{i}.rowid')
+            params += [query, limit * FTS_OVERFETCH]
+        with self._conn() as conn:
+            # One round trip: all tables ranked together by bm25 (lower is better)
+            return conn.execute(
+                f"WITH {', '.join(ctes)} {' UNION ALL '.join(arms)} ORDER BY score LIMIT ?",
+                params + [limit]
+            ).fetchall()
+
+    def _search_vectors(self, question: str, limit: int) -> List[tuple]:
+        embedding = self._embed([question])[0]
+        ann = self._ann_index()
+        if ann is not None:
+            return self._search_ann(ann, embedding, limit)
+        mapped = self._vectors()
+        if mapped is not None:
+            return self._search_mapped(embedding, limit, *mapped)
+        with self._conn() as conn:
+            return conn.execute(f'''
+                WITH v AS (
+                    SELECT rowid, distance FROM discourse_vec
+                    WHERE embedding MATCH ? AND k = ?
+                )
+                SELECT {FTS_TABLES['discourse_posts_fts'].result_columns}, v.distance
+                FROM v JOIN discourse_posts t ON t.id = v.rowid
+                ORDER BY v.distance
+            ''', (embedding.tobytes(), limit)).fetchall()
+
+    def _search_mapped(self, embedding: np.ndarray, limit: int, ids: np.ndarray, vectors: np.ndarray) -> List[tuple]:
+        scores = vectors @ embedding  # unit vectors, so this is cosine similarity
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        distances = {int(ids[i]): 1.0 - float(scores[i]) for i in top}
+        with self._conn() as conn:
+            rows = conn.execute(f'''
+                SELECT t.id, {FTS_TABLES['discourse_posts_fts'].result_columns}
+                FROM discourse_posts t WHERE t.id IN ({', '.join('?' * len(distances))})
+            ''', list(distances)).fetchall()
+        # Same layout and cosine-distance scale as the vec0 query
+        by_id = {r[0]: r[1:] for r in rows}
+        return [by_id[i] + (d,) for i, d in distances.items() if i in by_id]
+
+    def _search_ann(self, ann, embedding: np.ndarray, limit: int) -> List[tuple]:
+        with self._ann_lock:
+            _, found = ann.search(embedding[None], limit * FAISS_OVERFETCH)
+        ids = [int(i) for i in found[0] if i >= 0]
+        if not ids:
+            return []
+        # PQ distances are approximate; re-rank the candidates on their stored vectors
+        with self._conn() as conn:
+            return conn.execute(f'''
+                WITH v AS (
+                    SELECT rowid, vec_distance_cosine(embedding, ?) AS distance FROM discourse_vec
+                    WHERE rowid IN ({', '.join('?' * len(ids))})
+                )
+                SELECT {FTS_TABLES['discourse_posts_fts'].result_columns}, v.distance
+                FROM v JOIN discourse_posts t ON t.id = v.rowid
+                ORDER BY v.distance
+                LIMIT ?
+            ''', (embedding.tobytes(), *ids, limit)).fetchall()
+
+    def _row_to_result(self, row: tuple) -> Dict:
+        if row[0] == 'discourse':
+            return {
+                'type': 'discourse',
+                'title': row[1],
+                'url': row[2],
+                'content': row[3],
+                'excerpt': row[4]
+            }
+        return {
+            'type': 'course',
+            'title': row[1],
+            'content': row[3],
+            'source': row[5]
+        }
+
+    def _build_match_query(self, question: str) -> str:
+        # Quoted prefix terms OR-ed together; bm25 ranks docs matching more of them higher
+        return ' OR '.join(f'"{w}"*' for w in self._extract_keywords(question))
 
     def _extract_keywords(self, text: str) -> List[str]:
-        stop_words = {'the', 'is', 'at', 'which', 'on', 'a', 'an', 'and', 'or', 'but', 'in', 'with', 'to', 'for', 'of', 'as', 'by'}
-        words = re.findall(r'\b\w+\b', text.lower())
-        return [w for w in words if w not in stop_words and len(w) > 2][:5]
+        words = _WORD_RE.findall(text.lower())
+        # dict.fromkeys dedupes in order so repeats don't use up the five terms
+        return list(islice(dict.fromkeys(w for w in words if len(w) > 2 and w not in _STOP_WORDS), 5))
+
+
+class SemanticCache(SQLiteStore):
+    """Answers keyed by question embedding, matched on cosine similarity"""
+
+    def __init__(self, db_path: str = DATABASE_PATH, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 size: int = SEMANTIC_CACHE_SIZE):
+        super().__init__(db_path)
+        self.threshold = threshold
+        self.size = size
+        # (unit-normalized embedding rows, responses), always replaced together: add() and
+        # lookup() run concurrently on threadpool workers
+        self.entries: Tuple[Optional[np.ndarray], List[Dict]] = (None, [])
+        self._lock = threading.Lock()  # serializes concurrent add() read-modify-writes
+        self.generation = None  # qa_cache_state generation the in-memory copy was loaded at
+        self.init_table()
+        self.load()
+
+    def init_table(self):
+        with self._conn() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS qa_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    question TEXT,
+                    embedding BLOB,
+                    answer TEXT,
+                    links_json TEXT
+                )
+            ''')
+            # Bumped by clear(); every worker's copy reloads when it sees a new value
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS qa_cache_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    generation INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('INSERT OR IGNORE INTO qa_cache_state (id, generation) VALUES (0, 0)')
+            conn.commit()
+
+    def load(self):
+        with self._conn() as conn:
+            self.generation = self._generation(conn)
+            rows = conn.execute(
+                'SELECT embedding, answer, links_json FROM qa_cache ORDER BY id DESC LIMIT ?', (self.size,)
+            ).fetchall()[::-1]
+        self.entries = (
+            np.vstack([np.frombuffer(r[0], dtype=np.float32) for r in rows]) if rows else None,
+            [{"answer": r[1], "links": orjson.loads(r[2])} for r in rows]
+        )
+
+    def _generation(self, conn: sqlite3.Connection) -> int:
+        return conn.execute('SELECT generation FROM qa_cache_state WHERE id = 0').fetchone()[0]
+
+    def current_generation(self) -> int:
+        """Shared cache generation; every worker sees clear() through it"""
+        return self._generation(self._conn())
+
+    def lookup(self, embedding: np.ndarray) -> Optional[Dict]:
+        # Another worker may have cleared the cache since we loaded it
+        if self._generation(self._conn()) != self.generation:
+            self.load()
+        embeddings, responses = self.entries
+        if embeddings is None:
+            return None
+        sims = embeddings @ embedding
+        best = int(np.argmax(sims))
+        if sims[best] >= self.threshold:
+            return responses[best]
+        return None
+
+    def add(self, question: str, embedding: np.ndarray, response: Dict):
+        with self._conn() as conn:
+            conn.execute(
+                'INSERT INTO qa_cache (question, embedding, answer, links_json) VALUES (?, ?, ?, ?)',
+                (question, embedding.tobytes(), response["answer"], orjson.dumps(response["links"]).decode())
+            )
+            conn.execute(
+                'DELETE FROM qa_cache WHERE id NOT IN (SELECT id FROM qa_cache ORDER BY id DESC LIMIT ?)', (self.size,)
+            )
+            conn.commit()
+        row = embedding[np.newaxis, :]
+        with self._lock:
+            embeddings, responses = self.entries
+            # Bounded, oldest out; keeps each lookup a single small matrix-vector product
+            self.entries = (
+                row if embeddings is None else np.vstack([embeddings, row])[-self.size:],
+                (responses + [response])[-self.size:]
+            )
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute('DELETE FROM qa_cache')
+            conn.execute('UPDATE qa_cache_state SET generation = generation + 1 WHERE id = 0')
+            conn.commit()
+            self.generation = self._generation(conn)
+        self.entries = (None, [])
+
+
+class AnswerCache:
+    """Answers keyed by sha256 of the exact question and image; Redis errors degrade to L1 only
+
+    Keys carry the SemanticCache generation, so a clear() in any worker retires every
+    worker's L1 and Redis entries at once.
+    """
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL, maxsize: int = ANSWER_CACHE_SIZE, ttl: int = ANSWER_CACHE_TTL):
+        self.ttl = ttl
+        self.l1 = TTLCache(maxsize, ttl)
+        self.generation = None  # generation the L1 entries belong to
+        self.redis = aioredis.Redis.from_url(redis_url) if redis_url and aioredis else None
+
+    def key(self, question: str, image_base64: Optional[str], generation: int) -> str:
+        digest = hashlib.sha256(f"{question}|{image_base64 or ''}".encode()).hexdigest()
+        return f"{ANSWER_CACHE_PREFIX}{generation}:{digest}"
+
+    async def get(self, key: str, generation: int) -> Optional[Dict]:
+        # Another worker cleared the caches; our L1 only holds answers from the old corpus
+        if generation != self.generation:
+            self.l1.clear()
+            self.generation = generation
+        if key in self.l1:
+            return self.l1[key]
+        if not self.redis:
+            return None
+        try:
+            raw = await self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"Redis get failed: {e}")
+            return None
+        if raw is None:
+            return None
+        response = orjson.loads(raw)
+        self.l1[key] = response
+        return response
+
+    async def set(self, key: str, response: Dict):
+        self.l1[key] = response
+        if not self.redis:
+            return
+        try:
+            await self.redis.set(key, orjson.dumps(response), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Redis set failed: {e}")
+
+    async def clear(self):
+        self.l1.clear()
+        if not self.redis:
+            return
+        try:
+            # Only our keys; the Redis database may be shared
+            keys = [k async for k in self.redis.scan_iter(match=ANSWER_CACHE_PREFIX + '*')]
+            if keys:
+                await self.redis.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Redis clear failed: {e}")
+
+    async def aclose(self):
+        if self.redis:
+            await self.redis.aclose()
 
 
 class VirtualTA:
     def __init__(self):
         self.knowledge_base = KnowledgeBase()
         self.scraper = DiscourseScraperTDS()
+        self.cache = SemanticCache()
+        self.answers = AnswerCache()
 
-    def answer_question(self, question: str, image_base64: Optional[str] = None) -> Dict:
+    async def answer_question(self, question: str, image_base64: Optional[str] = None) -> Dict:
         try:
-            relevant = self.knowledge_base.search_relevant_content(question)
+            key, embedding, cached = await self._lookup_cache(question, image_base64)
+            if cached:
+                return cached
+            # SQLite is blocking; keep it off the event loop
+            relevant = await run_in_threadpool(self.knowledge_base.search_relevant_content, question)
             context = self._prepare_context(relevant)
-            answer = self._generate_answer(question, context, image_base64)
+            answer, generated = await self._generate_answer(question, context, image_base64)
             links = self._extract_links(relevant)
-            return {"answer": answer, "links": links}
+            response = {"answer": answer, "links": links}
+            # A fallback after a failed call must not be served to later questions
+            if generated:
+                await self._store_cache(key, question, embedding, response)
+            return response
         except Exception as e:
             logger.error(f"Answer error: {e}")
             return {
@@ -217,41 +1054,128 @@ class VirtualTA:
                 "links": []
             }
 
+    async def stream_answer(self, question: str, image_base64: Optional[str] = None) -> AsyncIterator[str]:
+        """Same pipeline as answer_question, emitted as SSE frames: tokens first, links last"""
+        try:
+            key, embedding, cached = await self._lookup_cache(question, image_base64)
+            if cached:
+                yield self._sse({"token": cached["answer"]})
+                yield self._sse({"links": cached["links"]})
+                return
+            relevant = await run_in_threadpool(self.knowledge_base.search_relevant_content, question)
+            context = self._prepare_context(relevant)
+            parts = []
+            generated = False
+            if openai_client:
+                try:
+                    async for token in self._stream_answer_tokens(question, context, image_base64):
+                        parts.append(token)
+                        yield self._sse({"token": token})
+                    generated = True
+                except Exception as e:
+                    logger.error(f"OpenAI error: {e}")
+            # Tokens already sent can't be retracted; only fall back on an empty stream,
+            # otherwise tell the client the answer it has is cut short
+            if not parts:
+                fallback = self._generate_fallback_answer(question, context)
+                parts.append(fallback)
+                yield self._sse({"token": fallback})
+            elif not generated:
+                yield self._sse({"error": "The answer was cut off. Please try again.", "incomplete": True})
+            links = self._extract_links(relevant)
+            yield self._sse({"links": links})
+            # Only a stream that finished cleanly is a whole answer worth caching
+            if generated:
+                await self._store_cache(key, question, embedding, {"answer": ''.join(parts).strip(), "links": links})
+        except Exception as e:
+            logger.error(f"Stream error: {e}")
+            yield self._sse({"error": "I encountered an error while processing your question. Please try again."})
+
+    def _sse(self, payload: Dict) -> str:
+        return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+    async def _lookup_cache(self, question: str, image_base64: Optional[str]) -> Tuple[str, Optional[np.ndarray], Optional[Dict]]:
+        """(answer cache key, question embedding, cached response); the key is reused when storing"""
+        generation = await run_in_threadpool(self.cache.current_generation)
+        # Exact repeats first; they don't need an embedding call
+        key = self.answers.key(question, image_base64, generation)
+        cached = await self.answers.get(key, generation)
+        if cached:
+            return key, None, cached
+        # Image questions can't be matched on text alone, so they skip the semantic cache
+        embedding = await self._embed(question) if not image_base64 else None
+        if embedding is None:
+            return key, None, None
+        # The generation check (and any reload) is a SQLite round trip; keep it off the event loop
+        cached = await run_in_threadpool(self.cache.lookup, embedding)
+        if cached:
+            await self.answers.set(key, cached)
+        return key, embedding, cached
+
+    async def _store_cache(self, key: str, question: str, embedding: Optional[np.ndarray], response: Dict):
+        await self.answers.set(key, response)
+        if embedding is not None:
+            await run_in_threadpool(self.cache.add, question, embedding, response)
+
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        if not openai_client:
+            return None
+        try:
+            response = await openai_client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+            vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+            return vector / np.linalg.norm(vector)
+        except Exception as e:
+            logger.error(f"Embedding error: {e}")
+            return None
+
     def _prepare_context(self, content: List[Dict]) -> str:
         return '\n\n---\n\n'.join([
             f"{c['type'].capitalize()} Content: {c['title']}\n{c['content']}"
             for c in content
         ])
 
-    def _generate_answer(self, question: str, context: str, image_base64: Optional[str] = None) -> str:
-        if not OPENAI_API_KEY:
-            return self._generate_fallback_answer(question, context)
+    async def _generate_answer(self, question: str, context: str, image_base64: Optional[str] = None) -> Tuple[str, bool]:
+        """The answer, and whether it came from the model rather than the fallback"""
+        if not openai_client:
+            return self._generate_fallback_answer(question, context), False
         try:
-            messages = [
-                {
-                    "role": "system",
-                    "content": """You are a helpful Teaching Assistant for the TDS course at IIT Madras. Be concise and helpful."""
-                },
-                {
-                    "role": "user",
-                    "content": f"Context:\n{context}\n\nQuestion: {question}"
-                }
-            ]
-            if image_base64:
-                messages[-1]["content"] = [
-                    {"type": "text", "text": f"Context:\n{context}\n\nQuestion: {question}"},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
-                ]
-            response = openai.ChatCompletion.create(
+            response = await openai_client.chat.completions.create(
                 model="gpt-3.5-turbo",
-                messages=messages,
+                messages=self._build_messages(question, context, image_base64),
                 max_tokens=300,
-                temperature=0.7
+                temperature=0.2
             )
-            return response.choices[0].message.content.strip()
+            return response.choices[0].message.content.strip(), True
         except Exception as e:
             logger.error(f"OpenAI error: {e}")
-            return self._generate_fallback_answer(question, context)
+            return self._generate_fallback_answer(question, context), False
+
+    async def _stream_answer_tokens(self, question: str, context: str, image_base64: Optional[str] = None) -> AsyncIterator[str]:
+        """Model tokens as they arrive; errors propagate so the caller knows the answer is incomplete"""
+        stream = await openai_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._build_messages(question, context, image_base64),
+            max_tokens=300,
+            temperature=0.2,
+            stream=True
+        )
+        async for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                yield token
+
+    def _build_messages(self, question: str, context: str, image_base64: Optional[str] = None) -> List[Dict]:
+        # Static prefix first; everything request-specific comes after it
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        if context:
+            messages.append({"role": "user", "content": f"Context:\n{context}"})
+        messages.append({"role": "user", "content": f"Question: {question}"})
+        if image_base64:
+            messages[-1]["content"] = [
+                {"type": "text", "text": f"Question: {question}"},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
+            ]
+        return messages
 
     def _generate_fallback_answer(self, question: str, context: str) -> str:
         if not context:
@@ -263,40 +1187,67 @@ class VirtualTA:
     def _extract_links(self, content: List[Dict]) -> List[Dict]:
         return [{"url": c["url"], "text": c.get("title", "Discussion")} for c in content if c["type"] == "discourse"][:3]
 
-    def update_knowledge_base(self):
-        posts = self.scraper.scrape_posts_by_date_range('2025-01-01', '2025-04-14')
-        self.knowledge_base.add_discourse_posts(posts)
+    async def update_knowledge_base(self):
+        known = await run_in_threadpool(self.knowledge_base.get_known_topics)
+        posts = await self.scraper.scrape_posts_by_date_range('2025-01-01', '2025-04-14', known)
+        await run_in_threadpool(self.knowledge_base.add_discourse_posts, posts)
+        # Cached answers were built from the old corpus
+        await run_in_threadpool(self.cache.clear)
+        await self.answers.clear()
         logger.info(f"Added {len(posts)} posts to DB")
 
 # ----- Init -----
-virtual_ta = VirtualTA()
+virtual_ta: Optional[VirtualTA] = None  # one per worker, created in lifespan
 
 # ----- Routes -----
+def validate_question_request(request: QuestionRequest):
+    if not request.question:
+        raise HTTPException(status_code=400, detail="Missing 'question'")
+    if request.image and (len(request.image) % 4 or not _B64_RE.fullmatch(request.image)):
+        raise HTTPException(status_code=400, detail="Invalid base64 image")
+
 @app.post("/api/")
-async def answer(request: QuestionRequest):
+async def answer(request: QuestionRequest) -> AnswerResponse:
     try:
-        if not request.question:
-            raise HTTPException(status_code=400, detail="Missing 'question'")
-        if request.image:
-            try:
-                base64.b64decode(request.image)
-            except Exception:
-                raise HTTPException(status_code=400, detail="Invalid base64 image")
-        response = virtual_ta.answer_question(request.question, request.image)
-        return response
+        validate_question_request(request)
+        response = await virtual_ta.answer_question(request.question, request.image)
+        return AnswerResponse(**response)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"API error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/api/stream")
+async def answer_stream(request: QuestionRequest):
+    validate_question_request(request)
+    return StreamingResponse(
+        virtual_ta.stream_answer(request.question, request.image),
+        media_type="text/event-stream"
+    )
+
 @app.post("/api/update")
-async def update_knowledge():
+async def update_knowledge() -> MessageResponse:
     try:
-        virtual_ta.update_knowledge_base()
-        return {"message": "Knowledge base updated"}
+        await virtual_ta.update_knowledge_base()
+        return MessageResponse(message="Knowledge base updated")
     except Exception as e:
         logger.error(f"Update error: {e}")
         raise HTTPException(status_code=500, detail="Failed to update")
 
 @app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
+async def health_check() -> HealthResponse:
+    return HealthResponse(status="healthy")
+
+if __name__ == "__main__":
+    import uvicorn
+    # One event loop per process; size the process count to the machine
+    uvicorn.run(
+        "api.main:app",
+        app_dir=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        host="0.0.0.0",
+        port=int(os.getenv('PORT', 8000)),
+        workers=int(os.getenv('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1)),
+        loop="uvloop",
+        http="httptools"
+    )
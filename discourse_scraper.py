@@ -4,27 +4,55 @@ Standalone Discourse Scraper for TDS Course
 This script scrapes Discourse posts from a specified date range and saves them to a database.
 """
 
-import requests
+import asyncio
+import httpx
+import ijson
 import json
+import orjson
 import sqlite3
-import time
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
 import argparse
 import logging
 
+from api.discourse_http import ResponseReader, TokenBucket
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+RETRY_STATUSES = {429, 502, 503, 504}
+# Search-result topic fields copied onto each post, with their defaults
+TOPIC_FIELDS = (
+    ('title', ''),
+    ('created_at', ''),
+    ('last_posted_at', ''),
+    ('category_name', ''),
+    ('posts_count', 0),
+    ('views', 0),
+    ('excerpt', ''),
+    ('tags', ()),
+)
+TOPIC_POSTS_LIMIT = 10  # Limit to first 10 posts per topic
+DEFAULT_RATE_LIMIT = 5  # requests per second
+
 class DiscourseScraperTDS:
     """Standalone scraper for TDS Discourse posts"""
     
-    def __init__(self, base_url="https://discourse.onlinedegree.iitm.ac.in"):
+    def __init__(self, base_url="https://discourse.onlinedegree.iitm.ac.in", max_concurrency=8,
+                 rate_limit=DEFAULT_RATE_LIMIT):
         self.base_url = base_url
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Connection': 'keep-alive',
+            'Accept-Encoding': 'gzip, br'
+        }
+        self.client = None
+        self._sem = None
+        self._limiter = None
+        # topic_id -> content, reset per scrape
+        self._topic_cache = {}
     
     def scrape_discourse_posts(self, start_date: str, end_date: str, output_file: str = 'tds_posts.json'):
         """
@@ -36,8 +64,6 @@ class DiscourseScraperTDS:
         """
         logger.info(f"Scraping posts from {start_date} to {end_date}")
         
-        posts = []
-        
         try:
             # Convert dates
             start_dt = datetime.strptime(start_date, '%Y-%m-%d')
@@ -50,11 +76,7 @@ class DiscourseScraperTDS:
                 'GA1', 'GA2', 'GA3', 'GA4', 'GA5', 'quiz', 'exam'
             ]
             
-            for term in search_terms:
-                logger.info(f"Searching for: {term}")
-                term_posts = self._search_posts_by_term(term, start_dt, end_dt)
-                posts.extend(term_posts)
-                time.sleep(2)  # Rate limiting
+            posts = asyncio.run(self._scrape_terms(search_terms, start_dt, end_dt))
             
             # Remove duplicates based on URL
             unique_posts = {}
@@ -76,70 +98,113 @@ class DiscourseScraperTDS:
             logger.error(f"Error during scraping: {e}")
             return []
     
-    def _search_posts_by_term(self, search_term: str, start_date: datetime, end_date: datetime):
-        """Search for posts containing a specific term"""
-        posts = []
-        page = 1
+    async def _scrape_terms(self, search_terms, start_date: datetime, end_date: datetime):
+        """Run all searches concurrently, then fetch every matched topic concurrently"""
+        # Created per run since each asyncio.run() gets a fresh event loop
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        self._limiter = TokenBucket(self.rate_limit)
+        self._topic_cache.clear()
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=32)
+        async with httpx.AsyncClient(headers=self.headers, limits=limits, http2=True, timeout=30) as client:
+            self.client = client
+            
+            results = await asyncio.gather(*[
+                self._search_posts_by_term(term, start_date, end_date) for term in search_terms
+            ])
+            
+            # Collect topics first so each topic is only fetched once
+            topics = {}
+            for term_topics in results:
+                for topic in term_topics:
+                    topics.setdefault(topic.get('id'), topic)
+            logger.info(f"Fetching content for {len(topics)} topics")
+            
+            posts = await asyncio.gather(*[self._extract_topic_data(topic) for topic in topics.values()])
         
-        while page <= 5:  # Limit to 5 pages per search term
-            try:
-                logger.info(f"  Searching page {page} for '{search_term}'")
-                
-                # Use Discourse search API
-                search_url = f"{self.base_url}/search.json"
-                params = {
-                    'q': f"{search_term} after:{start_date.strftime('%Y-%m-%d')} before:{end_date.strftime('%Y-%m-%d')}",
-                    'page': page
-                }
-                
-                response = self.session.get(search_url, params=params, timeout=30)
-                
-                if response.status_code != 200:
-                    logger.warning(f"Search failed with status {response.status_code}")
-                    break
-                
-                data = response.json()
-                topics = data.get('topics', [])
-                
-                if not topics:
-                    logger.info(f"  No more results for '{search_term}' on page {page}")
-                    break
-                
-                for topic in topics:
-                    post_data = self._extract_topic_data(topic)
-                    if post_data:
-                        posts.append(post_data)
-                
-                page += 1
-                time.sleep(1)  # Rate limiting between pages
-                
-            except Exception as e:
-                logger.error(f"Error searching for '{search_term}' page {page}: {e}")
+        self.client = None
+        return [post for post in posts if post]
+    
+    async def _get(self, url, params=None):
+        """GET bounded by the concurrency semaphore"""
+        async with self._sem:
+            return await self._send(url, params)
+    
+    async def _send(self, url, params=None, stream=False):
+        """GET that backs off only on retryable statuses; streamed responses must be closed by the caller"""
+        for attempt in range(4):
+            await self._limiter.acquire()
+            request = self.client.build_request('GET', url, params=params)
+            response = await self.client.send(request, stream=stream)
+            if response.status_code not in RETRY_STATUSES or attempt == 3:
+                return response
+            
+            await response.aclose()
+            delay = 0.5 * 2 ** attempt
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                delay = int(retry_after)
+            logger.warning(f"Got {response.status_code} for {url}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+    
+    async def _search_posts_by_term(self, search_term: str, start_date: datetime, end_date: datetime):
+        """Search for topics containing a specific term"""
+        logger.info(f"Searching for: {search_term}")
+        
+        # Request all pages at once; keep results up to the first empty page
+        pages = await asyncio.gather(*[
+            self._search_page(search_term, page, start_date, end_date) for page in range(1, 6)  # Limit to 5 pages per search term
+        ])
+        
+        topics = []
+        for page_topics in pages:
+            if not page_topics:
                 break
+            topics.extend(page_topics)
         
-        return posts
+        return topics
+    
+    async def _search_page(self, search_term: str, page: int, start_date: datetime, end_date: datetime):
+        """Fetch a single page of search results"""
+        try:
+            logger.info(f"  Searching page {page} for '{search_term}'")
+            
+            # Use Discourse search API
+            search_url = f"{self.base_url}/search.json"
+            params = {
+                'q': f"{search_term} after:{start_date.strftime('%Y-%m-%d')} before:{end_date.strftime('%Y-%m-%d')}",
+                'page': page
+            }
+            
+            response = await self._get(search_url, params=params)
+            
+            if response.status_code != 200:
+                logger.warning(f"Search failed with status {response.status_code}")
+                return []
+            
+            data = orjson.loads(response.content)
+            topics = data.get('topics', [])
+            
+            if not topics:
+                logger.info(f"  No more results for '{search_term}' on page {page}")
+            
+            return topics
+            
+        except Exception as e:
+            logger.error(f"Error searching for '{search_term}' page {page}: {e}")
+            return []
     
-    def _extract_topic_data(self, topic):
+    async def _extract_topic_data(self, topic):
         """Extract data from a topic"""
         try:
             topic_id = topic.get('id')
             slug = topic.get('slug', '')
             
-            post_data = {
-                'id': topic_id,
-                'title': topic.get('title', ''),
-                'url': f"{self.base_url}/t/{slug}/{topic_id}",
-                'created_at': topic.get('created_at', ''),
-                'last_posted_at': topic.get('last_posted_at', ''),
-                'category_name': topic.get('category_name', ''),
-                'posts_count': topic.get('posts_count', 0),
-                'views': topic.get('views', 0),
-                'excerpt': topic.get('excerpt', ''),
-                'tags': topic.get('tags', [])
-            }
+            post_data = {key: topic.get(key, default) for key, default in TOPIC_FIELDS}
+            post_data['id'] = topic_id
+            post_data['url'] = f"{self.base_url}/t/{slug}/{topic_id}"
             
             # Fetch full content
-            content = self._fetch_topic_content(topic_id)
+            content = await self._fetch_topic_content(topic_id)
             post_data['content'] = content
             
             return post_data
@@ -148,27 +213,43 @@ class DiscourseScraperTDS:
             logger.error(f"Error extracting topic data: {e}")
             return None
     
-    def _fetch_topic_content(self, topic_id):
+    async def _fetch_topic_content(self, topic_id):
         """Fetch full content of a topic"""
+        if topic_id in self._topic_cache:
+            return self._topic_cache[topic_id]
+        
         try:
             topic_url = f"{self.base_url}/t/{topic_id}.json"
-            response = self.session.get(topic_url, timeout=30)
             
-            if response.status_code == 200:
-                data = response.json()
-                posts = data.get('post_stream', {}).get('posts', [])
-                
-                content_parts = []
-                for post in posts[:10]:  # Limit to first 10 posts per topic
-                    raw_content = post.get('raw', '')
-                    username = post.get('username', 'Unknown')
-                    created_at = post.get('created_at', '')
+            async with self._sem:
+                response = await self._send(topic_url, stream=True)
+                try:
+                    if response.status_code != 200:
+                        return ""
                     
-                    if raw_content:
-                        post_content = f"[{username} - {created_at}]\n{raw_content}"
-                        content_parts.append(post_content)
-                
-                return '\n\n---\n\n'.join(content_parts)
+                    # Parse posts incrementally and stop once we have enough,
+                    # instead of decoding the whole post stream
+                    content_parts = []
+                    posts = ijson.items(ResponseReader(response), 'post_stream.posts.item', use_float=True)
+                    seen = 0
+                    async for post in posts:
+                        raw_content = post.get('raw', '')
+                        username = post.get('username', 'Unknown')
+                        created_at = post.get('created_at', '')
+                        
+                        if raw_content:
+                            post_content = f"[{username} - {created_at}]\n{raw_content}"
+                            content_parts.append(post_content)
+                        
+                        seen += 1
+                        if seen == TOPIC_POSTS_LIMIT:
+                            break
+                finally:
+                    await response.aclose()
+            
+            content = '\n\n---\n\n'.join(content_parts)
+            self._topic_cache[topic_id] = content
+            return content
                 
         except Exception as e:
             logger.error(f"Error fetching content for topic {topic_id}: {e}")
@@ -180,6 +261,9 @@ class DiscourseScraperTDS:
         try:
             with sqlite3.connect(db_path) as conn:
                 cursor = conn.cursor()
+                cursor.execute('PRAGMA journal_mode = WAL')
+                cursor.execute('PRAGMA synchronous = NORMAL')
+                cursor.execute('PRAGMA temp_store = MEMORY')
                 
                 # Create table if not exists
                 cursor.execute('''
@@ -198,32 +282,51 @@ class DiscourseScraperTDS:
                     )
                 ''')
                 
-                # Insert posts
-                for post in posts:
-                    try:
-                        cursor.execute('''
-                            INSERT OR REPLACE INTO discourse_posts 
-                            (id, title, url, content, created_at, last_posted_at, 
-                             category_name, posts_count, views, excerpt, tags)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            post.get('id'),
-                            post.get('title', ''),
-                            post.get('url', ''),
-                            post.get('content', ''),
-                            post.get('created_at', ''),
-                            post.get('last_posted_at', ''),
-                            post.get('category_name', ''),
-                            post.get('posts_count', 0),
-                            post.get('views', 0),
-                            post.get('excerpt', ''),
-                            json.dumps(post.get('tags', []))
-                        ))
-                    except Exception as e:
-                        logger.error(f"Error inserting post {post.get('id')}: {e}")
+                # Insert posts in a single batch, one row per url (the last one wins)
+                rows = list({post.get('url', ''): (
+                    post.get('id'),
+                    post.get('title', ''),
+                    post.get('url', ''),
+                    post.get('content', ''),
+                    post.get('created_at', ''),
+                    post.get('last_posted_at', ''),
+                    post.get('category_name', ''),
+                    post.get('posts_count', 0),
+                    post.get('views', 0),
+                    post.get('excerpt', ''),
+                    json.dumps(post.get('tags', []))
+                ) for post in posts}.values())
+                # A url now owned by another topic id belongs to a stale row: remove it first,
+                # so the id upsert below can't hit the url constraint and fail the batch
+                cursor.executemany(
+                    'DELETE FROM discourse_posts WHERE url = ? AND id != ?',
+                    [(row[2], row[0]) for row in rows if row[0] is not None]
+                )
+                if cursor.rowcount > 0:
+                    logger.info(f"Replaced {cursor.rowcount} stale posts whose url moved to another topic")
+                # Upsert in place (by topic id, or by url for posts without one) rather than delete + reinsert
+                updates = '''
+                    title = excluded.title,
+                    content = excluded.content,
+                    created_at = excluded.created_at,
+                    last_posted_at = excluded.last_posted_at,
+                    category_name = excluded.category_name,
+                    posts_count = excluded.posts_count,
+                    views = excluded.views,
+                    excerpt = excluded.excerpt,
+                    tags = excluded.tags
+                '''
+                cursor.executemany(f'''
+                    INSERT INTO discourse_posts 
+                    (id, title, url, content, created_at, last_posted_at, 
+                     category_name, posts_count, views, excerpt, tags)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET url = excluded.url, {updates}
+                    ON CONFLICT(url) DO UPDATE SET {updates}
+                ''', rows)
                 
                 conn.commit()
-                logger.info(f"Saved {len(posts)} posts to database")
+                logger.info(f"Saved {len(rows)} posts to database")
                 
         except Exception as e:
             logger.error(f"Error saving to database: {e}")
@@ -236,10 +339,12 @@ def main():
     parser.add_argument('--database', default='tds_knowledge.db', help='SQLite database file')
     parser.add_argument('--base-url', default='https://discourse.onlinedegree.iitm.ac.in', 
                        help='Discourse base URL')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_RATE_LIMIT,
+                       help='Maximum requests per second to Discourse')
     
     args = parser.parse_args()
     
-    scraper = DiscourseScraperTDS(base_url=args.base_url)
+    scraper = DiscourseScraperTDS(base_url=args.base_url, rate_limit=args.rate_limit)
     
     # Scrape posts
     posts = scraper.scrape_discourse_posts(args.start_date, args.end_date, args.output)
@@ -1,5 +1,5 @@
-import requests
-import json
+import httpx
+import orjson
 from datetime import datetime, timedelta
 
 # Config - change as needed
@@ -7,16 +7,25 @@ DISCOURSE_BASE_URL = "https://discourse.onlinedegree.iitm.ac.in"
 CATEGORY_ID = 5  # example category for TDS course (check actual category ID)
 START_DATE = "2025-01-01"
 END_DATE = "2025-04-14"
+OUTPUT_FILE = "discourse_posts.jsonl"
+
+# One keep-alive HTTP/2 pool for the whole run instead of a TLS handshake per request
+CLIENT = httpx.Client(
+    http2=True,
+    headers={"User-Agent": "Mozilla/5.0"},
+    timeout=15,
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+)
 
 def fetch_topics(category_id, page=0):
     url = f"{DISCOURSE_BASE_URL}/c/{category_id}.json?page={page}"
-    resp = requests.get(url)
+    resp = CLIENT.get(url)
     resp.raise_for_status()
     return resp.json()
 
 def fetch_posts(topic_id):
     url = f"{DISCOURSE_BASE_URL}/t/{topic_id}.json"
-    resp = requests.get(url)
+    resp = CLIENT.get(url)
     resp.raise_for_status()
     return resp.json()
 
@@ -24,11 +33,7 @@ def parse_date(date_str):
     # Example: "2025-02-14T18:25:43.000Z"
     return datetime.strptime(date_str[:10], "%Y-%m-%d")
 
-def main():
-    start = datetime.strptime(START_DATE, "%Y-%m-%d")
-    end = datetime.strptime(END_DATE, "%Y-%m-%d")
-
-    all_posts = []
+def iter_posts(start, end):
     page = 0
 
     while True:
@@ -46,7 +51,7 @@ def main():
                 for post in posts:
                     post_date = parse_date(post["created_at"])
                     if start <= post_date <= end:
-                        all_posts.append({
+                        yield {
                             "topic_id": topic_id,
                             "topic_title": topic["title"],
                             "post_id": post["id"],
@@ -55,15 +60,23 @@ def main():
                             "created_at": post["created_at"],
                             "cooked": post["cooked"],  # HTML content
                             "raw": post.get("raw", "")
-                        })
+                        }
 
         page += 1
 
-    # Save all posts to JSON
-    with open("discourse_posts.json", "w", encoding="utf-8") as f:
-        json.dump(all_posts, f, ensure_ascii=False, indent=2)
+def main():
+    start = datetime.strptime(START_DATE, "%Y-%m-%d")
+    end = datetime.strptime(END_DATE, "%Y-%m-%d")
+
+    # Save posts as JSON Lines while scraping, so memory stays flat however many there are
+    saved = 0
+    with open(OUTPUT_FILE, "wb") as f:
+        for post in iter_posts(start, end):
+            f.write(orjson.dumps(post))
+            f.write(b"\n")
+            saved += 1
 
-    print(f"Saved {len(all_posts)} posts to discourse_posts.json")
+    print(f"Saved {saved} posts to {OUTPUT_FILE}")
 
 if __name__ == "__main__":
     main()